@@ -0,0 +1,533 @@
+'''Static analysis passes over a parsed program
+
+The passes in this module run once over the AST after parsing and before
+execution. They walk the statements in execution order, tracking what is
+known to be true at each point, and annotate the nodes with what they were
+able to prove so the nodes can take faster paths at runtime.
+'''
+from ast import *
+
+
+def subexpressions(node):
+    '''Return the operands of an expression node'''
+    if isinstance(node, BinaryOp):
+        return [node.left, node.right]
+    elif isinstance(node, UnaryOp):
+        return [node.expr]
+    elif isinstance(node, Length):
+        return [node.array]
+    elif isinstance(node, Index):
+        return [node.target, node.index]
+    elif isinstance(node, MatrixIndex):
+        return [node.target, node.row, node.col]
+    elif isinstance(node, Slice):
+        return [expr for expr in [node.target, node.start, node.stop] if expr is not None]
+    elif isinstance(node, List):
+        return node.items
+    elif isinstance(node, Map):
+        return [expr for item in node.items for expr in item]
+    elif isinstance(node, FunctionCall):
+        return node.call_args.items
+    return []
+
+
+class Analysis(object):
+    '''Forward data flow analysis over statement lists
+
+    Subclasses describe what is known at a point of the program with a state
+    value and define how assignments and conditions change it (`assign`,
+    `kill`, `assume`) and how the states of two paths merge (`join`). States
+    must be comparable with `==` and `join` may only lose information so loops
+    reach a fixed point.
+
+    `visit` is called on every expression and index assignment with the state
+    that holds when it is executed. Inside loops the body is analyzed several
+    times until the state at the top of the loop stops changing, `final` is
+    only set on the last walk, once the state is known to be valid for every
+    iteration, so that is when nodes should be annotated.
+    '''
+    def __init__(self):
+        self.final = True
+
+    def run(self, statements):
+        self.statements(statements, self.initial())
+
+    def initial(self):
+        raise NotImplementedError
+
+    def join(self, a, b):
+        raise NotImplementedError
+
+    def assign(self, state, name, expr):
+        return self.kill(state, name)
+
+    def kill(self, state, name):
+        return state
+
+    def assume(self, state, expr):
+        return state
+
+    def visit(self, node, state):
+        pass
+
+    def statements(self, node, state):
+        for stmt in node.children:
+            state = self.statement(stmt, state)
+        return state
+
+    def statement(self, node, state):
+        if isinstance(node, Assign):
+            self.expression(node.expr, state)
+            return self.assign(state, node.name, node.expr)
+        elif isinstance(node, IndexAssign):
+            for expr in (node.ref, node.index, node.value):
+                self.expression(expr, state)
+            self.visit(node, state)
+        elif isinstance(node, MatrixAssign):
+            for expr in (node.ref, node.row, node.col, node.value):
+                self.expression(expr, state)
+        elif isinstance(node, (Print, Return, BareExpression)):
+            self.expression(node.expr, state)
+        elif isinstance(node, Conditional):
+            return self.conditional(node, state)
+        elif isinstance(node, Loop):
+            return self.loop(node, state)
+        elif isinstance(node, ForEach):
+            return self.for_each(node, state)
+        elif isinstance(node, Function):
+            self.function(node)
+            return self.kill(state, node.name)
+        elif isinstance(node, Import):
+            # Any name may be redefined by the imported module
+            return self.initial()
+        return state
+
+    def function(self, node):
+        # Function bodies run in their own scope, nothing known about the
+        # definition site holds when they are called. Lazily parsed bodies are
+        # analyzed once parsed.
+        if isinstance(node.body, StatementList):
+            self.statements(node.body, self.initial())
+
+    def conditional(self, node, state):
+        exits = []
+        for branch in node.children:
+            self.expression(branch.expr, state)
+            exits.append(
+                self.statements(branch.statements, self.assume(state, branch.expr))
+            )
+
+        # Falling through every branch without an `else` leaves the state as is
+        if node.fallback:
+            exits.append(self.statements(node.fallback, state))
+        else:
+            exits.append(state)
+
+        return reduce(self.join, exits)
+
+    def loop(self, node, state):
+        final, self.final = self.final, False
+
+        head = state
+        while True:
+            self.expression(node.expr, head)
+            end = self.statements(node.body, self.assume(head, node.expr))
+            joined = self.join(head, end)
+            if joined == head:
+                break
+            head = joined
+
+        self.final = final
+        if final:
+            self.expression(node.expr, head)
+            self.statements(node.body, self.assume(head, node.expr))
+
+        return head
+
+    def for_each(self, node, state):
+        self.expression(node.expr, state)
+        final, self.final = self.final, False
+
+        # Nothing is known about the items, the loop variable is just assigned
+        head = state
+        while True:
+            end = self.statements(node.body, self.assign(head, node.name, None))
+            joined = self.join(head, end)
+            if joined == head:
+                break
+            head = joined
+
+        self.final = final
+        if final:
+            self.statements(node.body, self.assign(head, node.name, None))
+
+        return head
+
+    def expression(self, node, state):
+        if isinstance(node, LogicalOp) and node.op == 'and':
+            # The right operand of `and` is only evaluated if the left is true
+            self.expression(node.left, state)
+            self.expression(node.right, self.assume(state, node.left))
+        else:
+            for child in subexpressions(node):
+                self.expression(child, state)
+
+        self.visit(node, state)
+
+
+class BoundsAnalysis(Analysis):
+    '''Prove indexes into lists in range so the runtime checks can be skipped
+
+    The state is a set of facts about names that hold at a point:
+
+    - `('int', name)`: `name` is an integer
+    - `('nonneg', name)`: `name` is not negative
+    - `('below', name, array)`: `name` is less than `len array`
+    - `('le', name, other)`: `name` is at most `other`
+
+    Facts come from assignments (`i = 0`, `i = i + 1`, `last = len a - 1`,
+    `mid = lo + (hi - lo) // 2`) and from conditions guarding the code
+    (`while (i < len a)`, `if (i >= 0)`, `while (lo <= hi)`). Assigning to a
+    name drops every fact about it. Lists never shrink, so nothing else can
+    invalidate `below` facts.
+
+    An `Index`/`IndexAssign` of the form `a[i]` is marked `safe` when `i` is
+    known to be an integer, not negative and below `len a`.
+    '''
+    def initial(self):
+        return frozenset()
+
+    def join(self, a, b):
+        return a & b
+
+    def kill(self, state, name):
+        return frozenset(fact for fact in state if name not in fact[1:])
+
+    def assign(self, state, name, expr):
+        facts = set(self.kill(state, name))
+        if self.is_int(expr, state):
+            facts.add(('int', name))
+        if self.is_nonneg(expr, state):
+            facts.add(('nonneg', name))
+        for array in self.bounds(expr, state):
+            facts.add(('below', name, array))
+        return frozenset(facts)
+
+    def assume(self, state, expr):
+        return state | self.facts(expr)
+
+    def facts(self, expr):
+        '''Facts that hold when `expr` is true'''
+        if isinstance(expr, LogicalOp) and expr.op == 'and':
+            return self.facts(expr.left) | self.facts(expr.right)
+
+        if not isinstance(expr, ComparisonOp) or expr.op not in ['<', '>', '<=', '>=']:
+            return frozenset()
+
+        # Normalize to `lesser < greater` or `lesser <= greater`
+        if expr.op in ['<', '<=']:
+            lesser, greater = expr.left, expr.right
+        else:
+            lesser, greater = expr.right, expr.left
+        strict = expr.op in ['<', '>']
+
+        facts = set()
+        if isinstance(greater, Lookup):
+            bound = literal_int(lesser)
+            if bound is not None and (bound >= 0 or (strict and bound >= -1)):
+                facts.add(('nonneg', greater.name))
+
+        if isinstance(lesser, Lookup):
+            if isinstance(greater, Lookup):
+                facts.add(('le', lesser.name, greater.name))
+            for array in self.bounds(greater, frozenset(), strict=not strict):
+                facts.add(('below', lesser.name, array))
+
+        return frozenset(facts)
+
+    def bounds(self, expr, state, strict=True):
+        '''Names of the lists whose length `expr` is below
+
+        With `strict` false, the lists whose length `expr` is at most.
+        '''
+        if isinstance(expr, Lookup):
+            return self.name_bounds(expr.name, state)
+        elif isinstance(expr, Length):
+            if not strict and isinstance(expr.array, Lookup):
+                return {expr.array.name}
+        elif isinstance(expr, ArithmeticOp) and expr.op == '-':
+            # `len a - 1`, `i - 1`
+            value = literal_int(expr.right)
+            if value is not None and value >= 0:
+                return self.bounds(expr.left, state, strict=strict and value == 0)
+        elif isinstance(expr, ArithmeticOp) and expr.op == '+':
+            # `lo + (hi - lo) // 2` is between `lo` and `hi`
+            (lo, hi) = midpoint(expr)
+            if hi is not None and ('le', lo, hi) in state:
+                return self.name_bounds(hi, state)
+        return set()
+
+    def name_bounds(self, name, state):
+        '''Names of the lists whose length the value of `name` is below'''
+        names = set()
+        for fact in state:
+            if fact[:2] == ('below', name):
+                names.add(fact[2])
+            elif fact[:2] == ('le', name):
+                # `name <= other < len array`
+                names.update(
+                    other[2] for other in state if other[:2] == ('below', fact[2])
+                )
+        return names
+
+    def is_int(self, expr, state):
+        if isinstance(expr, Lookup):
+            return ('int', expr.name) in state
+        elif isinstance(expr, Length):
+            return True
+        elif isinstance(expr, ArithmeticOp) and expr.op in ['+', '-', '*', '//', '%']:
+            return self.is_int(expr.left, state) and self.is_int(expr.right, state)
+        elif isinstance(expr, UnaryOp) and expr.op == '-':
+            return self.is_int(expr.expr, state)
+        return literal_int(expr) is not None
+
+    def is_nonneg(self, expr, state):
+        if isinstance(expr, Lookup):
+            return ('nonneg', expr.name) in state
+        elif isinstance(expr, Length):
+            return True
+        elif isinstance(expr, ArithmeticOp):
+            if expr.op in ['+', '*', '//']:
+                return self.is_nonneg(expr.left, state) and self.is_nonneg(expr.right, state)
+            elif expr.op == '%':
+                # The result of modulo takes the sign of the divisor
+                return self.is_nonneg(expr.right, state)
+            elif expr.op == '-':
+                return (
+                    isinstance(expr.left, Lookup) and
+                    isinstance(expr.right, Lookup) and
+                    ('le', expr.right.name, expr.left.name) in state
+                )
+            return False
+
+        value = literal_int(expr)
+        return value is not None and value >= 0
+
+    def is_safe(self, target, index, state):
+        if not isinstance(target, Lookup) or not isinstance(index, Lookup):
+            return False
+
+        return (
+            ('int', index.name) in state and
+            ('nonneg', index.name) in state and
+            ('below', index.name, target.name) in state
+        )
+
+    def visit(self, node, state):
+        if not self.final:
+            return
+
+        if isinstance(node, Index):
+            node.safe = self.is_safe(node.target, node.index, state)
+        elif isinstance(node, IndexAssign):
+            node.safe = self.is_safe(node.ref, node.index, state)
+
+
+NUMBERS = ['int', 'float', 'num']
+
+
+class TypeInference(Analysis):
+    '''Infer the types of names and expressions to specialize operators
+
+    The state maps names to the type they are known to hold: `int`, `float`,
+    `bool`, `str`, `list` or `map`, with `num` for a value that is either an `int` or
+    a `float`. Names missing from the state may hold anything.
+
+    Operators whose operands are proven to be numbers are rewritten into
+    their `Numeric*` variants, which skip the runtime type checks.
+    '''
+    SPECIALIZED = {
+        ArithmeticOp: NumericArithmeticOp,
+        ComparisonOp: NumericComparisonOp,
+        UnaryOp: NumericNegation,
+    }
+
+    def __init__(self):
+        super(TypeInference, self).__init__()
+        self.context = None
+        self.inferred = []
+
+    def initial(self):
+        return {}
+
+    def join(self, a, b):
+        joined = {}
+        for name in a:
+            if name in b:
+                type_ = join_types(a[name], b[name])
+                if type_ is not None:
+                    joined[name] = type_
+        return joined
+
+    def kill(self, state, name):
+        state = dict(state)
+        state.pop(name, None)
+        return state
+
+    def assign(self, state, name, expr):
+        type_ = self.type_of(expr, state)
+        state = self.kill(state, name)
+        if type_ is not None:
+            state[name] = type_
+        return state
+
+    def function(self, node):
+        context, self.context = self.context, node.name
+        super(TypeInference, self).function(node)
+        self.context = context
+
+    def type_of(self, expr, state):
+        if isinstance(expr, Literal):
+            return literal_type(expr.value)
+        elif isinstance(expr, Lookup):
+            return state.get(expr.name)
+        elif isinstance(expr, List):
+            return 'list'
+        elif isinstance(expr, Map):
+            return 'map'
+        elif isinstance(expr, Length):
+            return 'int'
+        elif isinstance(expr, (ComparisonOp, LogicalOp)):
+            return 'bool'
+        elif isinstance(expr, UnaryOp):
+            if expr.op == 'not':
+                return 'bool'
+            type_ = self.type_of(expr.expr, state)
+            return type_ if type_ in NUMBERS else None
+        elif isinstance(expr, Index):
+            if self.type_of(expr.target, state) == 'str':
+                return 'str'
+        elif isinstance(expr, Slice):
+            type_ = self.type_of(expr.target, state)
+            return type_ if type_ in ['str', 'list'] else None
+        elif isinstance(expr, ArithmeticOp):
+            return arithmetic_type(
+                expr.op,
+                self.type_of(expr.left, state),
+                self.type_of(expr.right, state)
+            )
+        return None
+
+    def visit(self, node, state):
+        if not self.final:
+            return
+
+        if isinstance(node, Lookup):
+            self.record(node, node.name, self.type_of(node, state))
+        elif type(node) in self.SPECIALIZED:
+            if isinstance(node, UnaryOp):
+                numeric = node.op == '-' and self.type_of(node.expr, state) in NUMBERS
+            else:
+                numeric = (
+                    self.type_of(node.left, state) in NUMBERS and
+                    self.type_of(node.right, state) in NUMBERS
+                )
+
+            if numeric:
+                node.__class__ = self.SPECIALIZED[type(node)]
+            self.record(
+                node,
+                'operator %s%s' % (node.op, ' (specialized)' if numeric else ''),
+                self.type_of(node, state)
+            )
+
+    def record(self, node, description, type_):
+        line = node.p.lineno(1) if node.p else 0
+        self.inferred.append((self.context, line, description, type_ or '?'))
+
+    def dump(self, out):
+        '''Write the inferred types of every name and operator to `out`'''
+        for (context, line, description, type_) in self.inferred:
+            print >> out, '%s line %d: %s: %s' % (
+                context or '<main>', line, description, type_
+            )
+
+
+def literal_type(value):
+    if isinstance(value, bool):
+        return 'bool'
+    elif isinstance(value, (int, long)):
+        return 'int'
+    elif isinstance(value, float):
+        return 'float'
+    elif isinstance(value, str):
+        return 'str'
+    return None
+
+
+def join_types(a, b):
+    '''Type of a value that is either of type `a` or `b`'''
+    if a == b:
+        return a
+    elif a in NUMBERS and b in NUMBERS:
+        return 'num'
+    return None
+
+
+def arithmetic_type(op, l, r):
+    '''Type of the result of the arithmetic operation `l op r`'''
+    if l in NUMBERS and r in NUMBERS:
+        if op == '/':
+            return 'float'
+        elif op == '^':
+            # Negative exponents turn integers into floats
+            return 'float' if 'float' in [l, r] else 'num'
+        elif l == r:
+            return l
+        elif 'num' in [l, r]:
+            return 'num'
+        return 'float'
+
+    if op == '+' and l == r and l in ['str', 'list']:
+        return l
+
+    return None
+
+
+def literal_int(expr):
+    '''Return the value of an integer literal, `None` for anything else'''
+    if isinstance(expr, Literal) and type(expr.value) is int:
+        return expr.value
+    elif (
+        isinstance(expr, UnaryOp) and expr.op == '-' and
+        isinstance(expr.expr, Literal) and type(expr.expr.value) is int
+    ):
+        return -expr.expr.value
+    return None
+
+
+def midpoint(expr):
+    '''Return the names `lo`, `hi` of an `lo + (hi - lo) // n` expression'''
+    step = expr.right
+    if (
+        isinstance(expr.left, Lookup) and isinstance(step, ArithmeticOp) and
+        step.op == '//' and (literal_int(step.right) or 0) >= 1 and
+        isinstance(step.left, ArithmeticOp) and step.left.op == '-' and
+        isinstance(step.left.left, Lookup) and isinstance(step.left.right, Lookup) and
+        step.left.right.name == expr.left.name
+    ):
+        return (expr.left.name, step.left.left.name)
+    return (None, None)
+
+
+def analyze(statements, dump=None):
+    '''Run the analysis passes over a parsed program
+
+    The inferred types are written to the file `dump` when given.
+    '''
+    BoundsAnalysis().run(statements)
+
+    inference = TypeInference()
+    inference.run(statements)
+    if dump is not None:
+        inference.dump(dump)
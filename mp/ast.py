@@ -1,7 +1,14 @@
 from __future__ import division
+import array
+import inspect
+import operator
+import sys
+import weakref
 
 
 class ParseError(Exception):
+    source = None
+
     def __init__(self, token):
         self.token = token
         self.message = 'Unrecognized character: %s' % token.value[0]
@@ -34,6 +41,11 @@ class LexicalError(Exception):
     def pos(self):
         return self.p.lexpos(self.error_index)
 
+    @property
+    def source(self):
+        '''The code the error happened in, if known'''
+        return getattr(self.p, 'source', None)
+
 class LookupError(LexicalError):
     def __init__(self, name, *args, **kwargs):
         self.name = name
@@ -56,6 +68,37 @@ class RuntimeError(Exception):
     def pos(self):
         return self.node.p.lexpos(self.index)
 
+    @property
+    def source(self):
+        '''The code the error happened in, if known'''
+        return getattr(getattr(self.node, 'p', None), 'source', None)
+
+
+class Context(object):
+    '''Environment shared by every scope of a running program
+
+    Holds the stream that `print` writes to (standard output when `None`),
+    the stream that `readline` reads from (standard input when `None`) and the
+    `memory.MemoryTracker` that allocations are reported to, if any.
+    `modules` has the scopes of the modules the program imported by their
+    path and `importing` the paths of the modules it is loading (see
+    `modules.load`).
+    `checkpoint` is called on every loop iteration and function call so that
+    a scheduler can switch to other programs there (see `scheduler.Task`).
+    '''
+    def __init__(self, output=None, memory=None, input=None):
+        self.output = output
+        self.memory = memory
+        self.input = input
+        self.modules = {}
+        self.importing = []
+
+    def checkpoint(self):
+        pass
+
+
+default_context = Context()
+
 
 class Scope(object):
     '''Container for variable bindings in a given scope
@@ -65,19 +108,25 @@ class Scope(object):
     allows a lookup to fallback to the parent scope when the value cannot be
     found in the current scope but provide a Copy-on-Write method that will
     override the variable in the current scope only, allowing recursion.
+
+    Scopes inherit the context of their parent unless given one.
     '''
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, context=None):
         self.names = {}
         self.parent = parent
 
+        if context is None:
+            context = parent.context if parent is not None else default_context
+        self.context = context
+
     def __getitem__(self, name):
-        try:
-            return self.names[name]
-        except KeyError:
-            if self.parent is not None:
-                return self.parent[name]
-            else:
-                raise LookupError(name=name)
+        scope = self
+        while scope is not None:
+            names = scope.names
+            if name in names:
+                return names[name]
+            scope = scope.parent
+        raise LookupError(name=name)
 
     def __setitem__(self, name, value):
         self.names[name] = value
@@ -92,6 +141,310 @@ class Scope(object):
 root_scope = Scope()
 
 
+class LazySequence(object):
+    '''A string or list whose actual Python value is only built when needed
+
+    Subclasses implement `flatten` to build the value, everything else falls
+    back to it.
+    '''
+    def flatten(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        return len(self.flatten())
+
+    def __getitem__(self, index):
+        return self.flatten()[index]
+
+    def __nonzero__(self):
+        return len(self) > 0
+
+    def __eq__(self, other):
+        return self.flatten() == flatten(other)
+
+    def __ne__(self, other):
+        return self.flatten() != flatten(other)
+
+    def __hash__(self):
+        return hash(self.flatten())
+
+    def __str__(self):
+        return str(self.flatten())
+
+    def __repr__(self):
+        return repr(self.flatten())
+
+
+class Rope(LazySequence):
+    '''A string built by repeated concatenation
+
+    Concatenating Python strings copies both operands, so a loop that builds a
+    string with `s = s + "..."` is quadratic in the final length. A rope keeps
+    the concatenated pieces in a list instead and only joins them when the
+    actual string is needed (indexing, printing, comparison).
+
+    Ropes share their list of pieces with the rope they were created from.
+    Appending to the newest rope of a list extends it in place, while
+    appending to an older rope copies the joined string first so that every
+    rope keeps seeing only its own pieces.
+    '''
+    def __init__(self, parts, length):
+        self.parts = parts
+        self.count = len(parts)
+        self.length = length
+        self.value = None
+
+    def concat(self, other):
+        if isinstance(other, LazySequence):
+            other = other.flatten()
+        elif not isinstance(other, str):
+            raise TypeError('Unable to concatenate a string and %s' % type(other))
+
+        if self.count == len(self.parts):
+            self.parts.append(other)
+            return Rope(self.parts, self.length + len(other))
+
+        return Rope([self.flatten(), other], self.length + len(other))
+
+    def flatten(self):
+        if self.value is None:
+            self.value = ''.join(self.parts[:self.count])
+            # Further concatenations of this rope start from the joined string
+            # instead of copying the (possibly many) pieces again
+            self.parts = [self.value]
+            self.count = 1
+        return self.value
+
+    def __len__(self):
+        return self.length
+
+
+class View(LazySequence):
+    '''The items of a list or string `base` from `start` up to `stop`
+
+    Slicing creates views instead of copying the items. A view shares the
+    items of its base until either of them is modified: assigning to an item
+    of a view first copies its items into a list of its own, and assigning to
+    an item of a list first makes every view of the list copy its items (see
+    `detach`). Slices of a view are views of the same base.
+    '''
+    def __init__(self, base, start, stop):
+        self.base = base
+        self.start = start
+        self.stop = stop
+        # Whether `base` is a copy only used by this view
+        self.owner = False
+        if isinstance(base, list):
+            watch(self)
+
+    def copy(self):
+        '''Stop sharing the items with the base'''
+        if not self.owner:
+            self.base = self.base[self.start:self.stop]
+            self.start = 0
+            self.stop = len(self.base)
+            self.owner = True
+
+    def flatten(self):
+        return self.base[self.start:self.stop]
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        # Only called with indexes already checked to be in range
+        return self.base[self.start + index]
+
+    def __setitem__(self, index, value):
+        self.copy()
+        if views:
+            detach(self.base)
+        self.base[self.start + index] = value
+
+    def __iter__(self):
+        # Writes during the loop may detach the view, which moves its items
+        for index in xrange(len(self)):
+            yield self.base[self.start + index]
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if not self.owner and isinstance(self.base, list):
+            watch(self)
+
+
+class Range(LazySequence):
+    '''The integers from `start` up to `stop`, `step` apart
+
+    The integers are computed when needed, so a range takes the same memory
+    however many integers it has.
+    '''
+    def __init__(self, start, stop, step=1):
+        self.items = xrange(start, stop, step)
+
+    def flatten(self):
+        return list(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+class Matrix(object):
+    '''A grid of `rows` by `cols` numbers, all set to `fill`
+
+    The numbers are stored row after row in a single array of machine
+    integers or floating point numbers (`items`) rather than as a list of
+    lists of Python objects. A matrix of integers switches to floating point
+    numbers the first time one is stored in it.
+    '''
+    def __init__(self, rows, cols, fill=0):
+        self.rows = rows
+        self.cols = cols
+        self.items = array.array(
+            'd' if isinstance(fill, float) else 'l', [fill]
+        ) * (rows * cols)
+
+    def promote(self):
+        '''Switch to storing floating point numbers'''
+        if self.items.typecode == 'l':
+            self.items = array.array('d', self.items)
+
+    def store(self, index, value):
+        '''Set the number at `index` of `items` to `value`'''
+        if isinstance(value, float):
+            self.promote()
+        self.items[index] = value
+
+    def row(self, i):
+        return self.items[i * self.cols:(i + 1) * self.cols]
+
+    def col(self, j):
+        return self.items[j::self.cols]
+
+    def tolist(self):
+        return [self.row(i).tolist() for i in xrange(self.rows)]
+
+    def __len__(self):
+        return self.rows
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Matrix) and
+            (self.rows, self.cols) == (other.rows, other.cols) and
+            self.items == other.items
+        )
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __str__(self):
+        return str(self.tolist())
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+
+def is_number(value):
+    return isinstance(value, (int, long, float)) and not isinstance(value, bool)
+
+
+# Views of lists by the id of the list they share, each a dict of weak
+# references by the id of the view
+views = {}
+
+
+def watch(view):
+    '''Register a view to be detached when its base list is modified'''
+    key = id(view.base)
+    watched = views.setdefault(key, {})
+
+    def forget(ref, view_key=id(view)):
+        watched.pop(view_key, None)
+        # The base may be gone, and its id reused by another list
+        if not watched and views.get(key) is watched:
+            del views[key]
+
+    watched[id(view)] = weakref.ref(view, forget)
+
+
+def detach(value):
+    '''Make the views of the list `value` copy their items before it changes'''
+    watched = views.pop(id(value), None)
+    if watched:
+        for ref in watched.values():
+            view = ref()
+            if view is not None:
+                view.copy()
+
+
+# Concatenations shorter than this are cheaper to copy than to track in a rope
+ROPE_THRESHOLD = 64
+
+# Slices shorter than this are cheaper to copy than to share in a view
+VIEW_THRESHOLD = 32
+
+
+def concat(l, r):
+    '''Concatenate two values, building ropes for long strings'''
+    if isinstance(l, Rope):
+        return l.concat(r)
+
+    if isinstance(l, LazySequence):
+        l = l.flatten()
+    if isinstance(r, LazySequence):
+        r = r.flatten()
+
+    if isinstance(l, str) and isinstance(r, (str, Rope)):
+        if len(l) + len(r) < ROPE_THRESHOLD:
+            return l + flatten(r)
+        return Rope([l, flatten(r)], len(l) + len(r))
+
+    return l + r
+
+
+def flatten(value):
+    '''Return the plain Python value of ropes and views, pass through
+    everything else'''
+    if isinstance(value, LazySequence):
+        return value.flatten()
+    return value
+
+
+def view(value, start, stop):
+    '''Return the items of `value` from `start` up to `stop`, sharing them
+    with `value` unless there are only a few'''
+    if isinstance(value, View):
+        (value, start, stop) = (value.base, value.start + start, value.start + stop)
+
+    if stop - start < VIEW_THRESHOLD:
+        return value[start:stop]
+    return View(value, start, stop)
+
+
+class Position(object):
+    '''Line numbers and positions of the symbols of a parsed production
+
+    YACC productions reference the whole parser state, so pickled nodes keep
+    only what error messages need from them in one of these instead.
+    '''
+    def __init__(self, p):
+        self.lines = [p.lineno(i) for i in range(len(p))]
+        self.positions = [p.lexpos(i) for i in range(len(p))]
+        self.source = getattr(p, 'source', None)
+        self.filename = getattr(p, 'filename', None)
+
+    def lineno(self, n):
+        return self.lines[n]
+
+    def lexpos(self, n):
+        return self.positions[n]
+
+
 class Node(object):
     '''Base AST node'''
     def __init__(self, p=None, children=None, parent=None, scope=None):
@@ -106,6 +459,17 @@ class Node(object):
         self.children.append(child)
         child.parent = self
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if state.get('p') is not None and not isinstance(state['p'], Position):
+            state['p'] = Position(state['p'])
+        state.pop('scope', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.scope = root_scope
+
 
 class Statement(Node):
     '''Statement AST node
@@ -157,11 +521,44 @@ class Assign(Statement):
 
         self.expr = expr
 
+        # Lists can only be grown with `a = a + [x]`, remember the appended
+        # item of that pattern so the list can be extended in place
+        self.append = None
+        if (
+            isinstance(expr, ArithmeticOp) and expr.op == '+' and
+            isinstance(expr.left, Lookup) and expr.left.name == name and
+            isinstance(expr.right, List) and len(expr.right.items) == 1
+        ):
+            self.append = expr.right.items[0]
+
     def execute(self, scope=root_scope):
+        if self.append is not None and self.name in scope:
+            current = scope.names[self.name]
+            if type(current) is list:
+                item = self.append.evaluate(scope)
+                # The list is referenced by the scope, `current` and the
+                # argument of `getrefcount`. Any other reference is an alias
+                # (another variable, a list item, a caller's argument) that
+                # must not see the new item, so concatenate into a copy.
+                if sys.getrefcount(current) <= 3:
+                    current.append(item)
+                    # The item was reported by the node that created it, the
+                    # list only grew by the slot pointing to it
+                    if scope.context.memory is not None:
+                        scope.context.memory.allocate(self, current, scope, size=8)
+                else:
+                    copied = scope.names[self.name] = current + [item]
+                    if scope.context.memory is not None:
+                        scope.context.memory.allocate(self, copied, scope)
+                return
+
         scope[self.name] = self.expr.evaluate(scope)
 
 class IndexAssign(Statement):
     '''Assign the value of an expression to an array `ref` at index `index`'''
+    # Set by `analysis.BoundsAnalysis` when the index is proven in range
+    safe = False
+
     def __init__(self, ref, index, value, *args, **kwargs):
         super(IndexAssign, self).__init__(*args, **kwargs)
         # References can be expressions so we can access indeces like this
@@ -194,7 +591,29 @@ class IndexAssign(Statement):
 
     def execute(self, scope=root_scope):
         ref = self.ref.evaluate(scope)
-        if not isinstance(ref, (str, list)):
+        # Other values with a length (i.e. ranges, strings) get the checks below
+        if self.safe and (
+            type(ref) is list or (type(ref) is View and type(ref.base) is list)
+        ):
+            if views:
+                detach(ref)
+            ref[self.index.evaluate(scope)] = self.value.evaluate(scope)
+            return
+
+        if isinstance(ref, Rope):
+            ref = ref.flatten()
+
+        if isinstance(ref, dict):
+            key = map_key(self, self.index.evaluate(scope), index=3)
+            ref[key] = self.value.evaluate(scope)
+            return
+
+        if isinstance(ref, str) or (isinstance(ref, View) and isinstance(ref.base, str)):
+            raise RuntimeError(
+                node=self, index=1, message='Unable to assign to an item of a string'
+            )
+
+        if not isinstance(ref, (list, View)):
             raise RuntimeError(
                 node=self, index=1, message='Unable to index a non-list'
             )
@@ -213,9 +632,53 @@ class IndexAssign(Statement):
                 message='Index out of range',
                 index=3
             )
+
+        if views:
+            detach(ref)
         ref[index] = self.value.evaluate(scope)
 
 
+class MatrixAssign(Statement):
+    '''Assign the value of an expression to a matrix `ref` at `row`, `col`'''
+    def __init__(self, ref, row, col, value, *args, **kwargs):
+        super(MatrixAssign, self).__init__(*args, **kwargs)
+        for (index, expr) in [(1, ref), (3, row), (5, col), (8, value)]:
+            if not isinstance(expr, Expression):
+                raise LexicalError(
+                    p=self.p,
+                    message='Expected an expression , got %s' % (expr.__class__),
+                    index=index
+                )
+
+        self.ref = ref
+        self.row = row
+        self.col = col
+        self.value = value
+
+    def execute(self, scope=root_scope):
+        matrix = self.ref.evaluate(scope)
+        if not isinstance(matrix, Matrix):
+            raise RuntimeError(
+                node=self, index=1, message='Unable to index a non-matrix by row and column'
+            )
+
+        index = matrix_index(self, matrix, self.row.evaluate(scope), self.col.evaluate(scope))
+        value = self.value.evaluate(scope)
+        if not is_number(value):
+            raise RuntimeError(
+                node=self,
+                index=8,
+                message='Invalid matrix item: "%s". Matrices only hold numbers' % value
+            )
+
+        try:
+            matrix.store(index, value)
+        except OverflowError:
+            raise RuntimeError(
+                node=self, index=8, message='Number too large for a matrix: %d' % value
+            )
+
+
 class Print(Statement):
     '''Print the value of an expression'''
     def __init__(self, expr, *args, **kwargs):
@@ -230,7 +693,7 @@ class Print(Statement):
         self.expr = expr
 
     def execute(self, scope=root_scope):
-        print self.expr.evaluate(scope)
+        print >> scope.context.output, flatten(self.expr.evaluate(scope))
 
 
 class ConditionalBranch(Node):
@@ -308,6 +771,61 @@ class Loop(Statement):
         # signalled from any of the nested code blocks
         while self.expr.evaluate(scope) and 'return' not in scope:
             self.body.execute(scope)
+            scope.context.checkpoint()
+
+
+class ForEach(Statement):
+    '''Execute a `body` of statements with `name` set to each item of `expr`
+
+    Lists, strings, slices and ranges are iterated by item and maps by their
+    sorted keys.
+    '''
+    # Types that can be iterated besides maps, modules defining new types of
+    # values (i.e. `streams`) add them here
+    iterables = (list, str, LazySequence)
+
+    def __init__(self, name, expr, body, *args, **kwargs):
+        super(ForEach, self).__init__(*args, **kwargs)
+        if not isinstance(expr, Expression):
+            raise LexicalError(
+                p=self.p,
+                message='Invalid loop expression',
+                index=5
+            )
+
+        if not isinstance(body, StatementList):
+            raise LexicalError(
+                p=self.p,
+                message='Invalid loop body',
+                index=8
+            )
+
+        self.name = name
+        self.expr = expr
+        self.body = body
+
+    def execute(self, scope=root_scope):
+        items = self.expr.evaluate(scope)
+        if isinstance(items, Rope):
+            items = items.flatten()
+        elif isinstance(items, dict):
+            items = sorted(items)
+        elif not isinstance(items, self.iterables):
+            raise RuntimeError(
+                node=self,
+                index=5,
+                message='Unable to iterate over a non-list'
+            )
+
+        (name, body) = (self.name, self.body)
+        names = scope.names
+        checkpoint = scope.context.checkpoint
+        for item in items:
+            names[name] = item
+            body.execute(scope)
+            if 'return' in names:
+                break
+            checkpoint()
 
 
 class Return(Statement):
@@ -324,24 +842,90 @@ class Return(Statement):
         return scope['return']
 
 
+class Import(Statement):
+    '''Load the top-level definitions of the module file `path` into scope
+
+    `directory` is the directory of the importing file, relative paths are
+    looked up there first. Loading is done by `modules.load`, which
+    `modules.loader` is set to.
+    '''
+    loader = None
+
+    def __init__(self, path, directory, *args, **kwargs):
+        super(Import, self).__init__(*args, **kwargs)
+        self.path = path
+        self.directory = directory
+
+    def execute(self, scope):
+        Import.loader(self, scope)
+
+
+class LazyBody(object):
+    '''The body of a function, not parsed until the function is first called
+
+    The statements are the code of `source` from `start` up to `end`, which
+    begins at line `lineno` and ends at the closing brace at line and
+    position `closing`. `filename` is the file the code was read from, if
+    any, and `directory` is where the imports of the body are looked up. `parser` (set by `lang`) parses and analyzes the statements.
+    '''
+    parser = None
+
+    def __init__(self, source, filename, directory, start, end, lineno, closing):
+        self.source = source
+        self.filename = filename
+        self.directory = directory
+        self.start = start
+        self.end = end
+        self.lineno = lineno
+        self.closing = closing
+
+    def parse(self):
+        return self.parser(self)
+
+
 class Function(Statement):
-    '''Define a function `name` with an expected list of arguments `arg_list`'''
+    '''Define a function `name` with an expected list of arguments `arg_list`
+
+    The `body` of the function is either its statements or a `LazyBody` that
+    is replaced by its statements on the first call.
+    '''
+
     def __init__(self, name, arg_list, body, *args, **kwargs):
         super(Function, self).__init__(*args, **kwargs)
         self.name = name
-        self.arg_list = arg_list
+        self.arg_list = tuple(arg_list)
+        self.arity = len(arg_list)
         self.body = body
 
     def execute(self, scope):
         # Define the function in scope
         if self.name in scope:
             raise RuntimeError(
-                node=self.p,
-                message='Unable to define function "%s". Name already defined',
+                node=self,
+                message='Unable to define function "%s". Name already defined' % self.name,
                 index=2
             )
         scope[self.name] = self
 
+    def call(self, arguments, scope):
+        '''Execute the function body with the values `arguments` bound to its
+        argument names in a new scope based on `scope`'''
+        if isinstance(self.body, LazyBody):
+            self.body = self.body.parse()
+
+        frame = Scope(parent=scope)
+        names = frame.names
+        names.update(zip(self.arg_list, arguments))
+        if frame.context.memory is not None:
+            frame.context.memory.allocate(self, names, frame, kind='frame')
+
+        # Execute the function body with the new scope
+        r = self.body.execute(frame)
+
+        # If the function returned something, use the return value as the
+        # value of this expression
+        return names.pop('return', r)
+
 
 class BareExpression(Statement):
     '''Execute an expression as-is
@@ -364,33 +948,77 @@ class FunctionCall(Expression):
         self.call_args = call_args
 
     def evaluate(self, scope):
-        # Get the function from the current scope
-        f = scope[self.name]
-
-        # Create a new scope based on the current scope
-        new_scope = Scope(parent=scope)
-        if len(self.call_args.items) != len(f.arg_list):
+        # Get the function from the current scope, falling back to the
+        # builtin functions for names that are not defined
+        name = self.name
+        owner = scope
+        while owner is not None:
+            names = owner.names
+            if name in names:
+                f = names[name]
+                break
+            owner = owner.parent
+        else:
+            if name not in BUILTINS:
+                raise LookupError(name=name, p=self.p)
+            return BUILTINS[name].call(self, scope)
+
+        items = self.call_args.items
+        if len(items) != f.arity:
             raise RuntimeError(
                 node=self,
                 message='%s expects %d argument(s), got %d' % (
-                    self.name, len(f.arg_list), len(self.call_args.items)
+                    name, f.arity, len(items)
                 ),
             )
 
-        for (i, arg) in enumerate(self.call_args.items):
-            # Inject the argument values in the new scope of the function
-            new_scope[f.arg_list[i]] = arg.evaluate(scope)
+        arguments = [arg.evaluate(scope) for arg in items]
+        scope.context.checkpoint()
+        return f.call(arguments, scope)
 
-        # Execute the function body with the new scope
-        r = f.body.execute(new_scope)
 
-        # If the function returned something, use the return value as the
-        # value of this expression
-        if 'return' in new_scope:
-            r = new_scope['return']
-            del new_scope['return']
+class Builtin(object):
+    '''A function implemented in Python that jt programs can call by name
+
+    The Python function receives the calling `FunctionCall` node (to report
+    errors against), the scope of the call and the evaluated arguments.
+    '''
+    def __init__(self, name, function):
+        self.name = name
+        self.function = function
 
-        return r
+        spec = inspect.getargspec(function)
+        self.max_args = len(spec.args) - 2
+        self.min_args = self.max_args - len(spec.defaults or [])
+
+    def call(self, node, scope):
+        count = len(node.call_args.items)
+        if not self.min_args <= count <= self.max_args:
+            if self.min_args == self.max_args:
+                expected = '%d' % self.max_args
+            else:
+                expected = '%d to %d' % (self.min_args, self.max_args)
+            raise RuntimeError(
+                node=node,
+                message='%s expects %s argument(s), got %d' % (
+                    self.name, expected, count
+                ),
+            )
+
+        return self.function(
+            node, scope, *[arg.evaluate(scope) for arg in node.call_args.items]
+        )
+
+
+BUILTINS = {}
+
+
+def builtin(name):
+    '''Register the decorated Python function as the builtin function `name`'''
+    def register(function):
+        BUILTINS[name] = Builtin(name, function)
+        return function
+    return register
 
 class Lookup(Expression):
     '''Lookup a name from the current scope and return its value'''
@@ -421,11 +1049,48 @@ class List(Expression):
         self.items = items if items else []
 
     def evaluate(self, scope):
-        return [i.evaluate(scope) for i in self.items]
+        items = [i.evaluate(scope) for i in self.items]
+        if scope.context.memory is not None:
+            scope.context.memory.allocate(self, items, scope)
+        return items
+
+
+class Map(Expression):
+    '''A map of keys to values, built from a list of `(key, value)` expressions'''
+    def __init__(self, items, *args, **kwargs):
+        super(Map, self).__init__(*args, **kwargs)
+        self.items = items
+
+    def evaluate(self, scope):
+        items = {}
+        for (key, value) in self.items:
+            items[map_key(self, key.evaluate(scope))] = value.evaluate(scope)
+
+        if scope.context.memory is not None:
+            scope.context.memory.allocate(self, items, scope)
+        return items
+
+
+def map_key(node, key, index=1):
+    '''Validate a value used as a map key, returning the key to use'''
+    key = flatten(key)
+    if isinstance(key, bool) or not isinstance(key, (str, int, long, float)):
+        raise RuntimeError(
+            node=node,
+            index=index,
+            message='Invalid map key: "%s". Keys must be strings or numbers' % key
+        )
+    return key
 
 
 class Index(Expression):
-    '''Return the value of the item in an array `target` at index `index`'''
+    '''Return the value of the item in an array `target` at index `index`
+
+    When `target` is a map, return the value of the key `index`.
+    '''
+    # Set by `analysis.BoundsAnalysis` when the index is proven in range
+    safe = False
+
     def __init__(self, target, index, *args, **kwargs):
         super(Index, self).__init__(*args, **kwargs)
         if not isinstance(index, Expression):
@@ -439,7 +1104,33 @@ class Index(Expression):
 
     def evaluate(self, scope):
         target = self.target.evaluate(scope)
-        if not isinstance(target, (str, list)):
+        # Other values with a length (i.e. matrices) get the checks below
+        if self.safe and type(target) in (list, str, View, Range, dict):
+            try:
+                return target[self.index.evaluate(scope)]
+            except KeyError as e:
+                # Maps have a length too, so a "safe" index may be a missing key
+                raise RuntimeError(
+                    node=self,
+                    message='Undefined key: %s' % e.args[0],
+                    index=3
+                )
+
+        if isinstance(target, Rope):
+            target = target.flatten()
+
+        if isinstance(target, dict):
+            key = map_key(self, self.index.evaluate(scope), index=3)
+            try:
+                return target[key]
+            except KeyError:
+                raise RuntimeError(
+                    node=self,
+                    message='Undefined key: %s' % key,
+                    index=3
+                )
+
+        if not isinstance(target, (str, list, LazySequence)):
             raise LexicalError(
                 p=self.p,
                 message='Invalid index target',
@@ -471,6 +1162,99 @@ class Index(Expression):
         return target[index]
 
 
+class Slice(Expression):
+    '''Return the items of `target` from index `start` up to `stop`
+
+    Missing bounds default to the beginning and the end of `target`. Long
+    slices are views sharing the items of `target` rather than copies.
+    '''
+    def __init__(self, target, start=None, stop=None, *args, **kwargs):
+        super(Slice, self).__init__(*args, **kwargs)
+        self.target = target
+        self.start = start
+        self.stop = stop
+
+    def evaluate(self, scope):
+        target = self.target.evaluate(scope)
+        if isinstance(target, Rope):
+            target = target.flatten()
+
+        if not isinstance(target, (str, list, View)):
+            raise RuntimeError(
+                node=self, index=1, message='Unable to slice a non-list'
+            )
+
+        start = 0 if self.start is None else self.start.evaluate(scope)
+        stop = len(target) if self.stop is None else self.stop.evaluate(scope)
+        for bound in [start, stop]:
+            if not isinstance(bound, int):
+                raise RuntimeError(
+                    node=self,
+                    message='Invalid slice bound: "%s"' % bound,
+                    index=2
+                )
+
+        if not 0 <= start <= stop <= len(target):
+            raise RuntimeError(
+                node=self,
+                message='Slice out of range: %d:%d' % (start, stop),
+                index=2
+            )
+
+        result = view(target, start, stop)
+        if scope.context.memory is not None:
+            scope.context.memory.allocate(self, result, scope)
+        return result
+
+
+class MatrixIndex(Expression):
+    '''Return the number of a matrix `target` at `row`, `col`'''
+    def __init__(self, target, row, col, *args, **kwargs):
+        super(MatrixIndex, self).__init__(*args, **kwargs)
+        for (index, expr) in [(3, row), (5, col)]:
+            if not isinstance(expr, Expression):
+                raise LexicalError(
+                    p=self.p,
+                    message='Invalid index expression',
+                    index=index
+                )
+
+        self.target = target
+        self.row = row
+        self.col = col
+
+    def evaluate(self, scope):
+        matrix = self.target.evaluate(scope)
+        if not isinstance(matrix, Matrix):
+            raise RuntimeError(
+                node=self, index=1, message='Unable to index a non-matrix by row and column'
+            )
+
+        return matrix.items[
+            matrix_index(self, matrix, self.row.evaluate(scope), self.col.evaluate(scope))
+        ]
+
+
+def matrix_index(node, matrix, row, col):
+    '''Validate a row and column of `matrix`, returning the index of the item'''
+    for (index, value, size) in [(3, row, matrix.rows), (5, col, matrix.cols)]:
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise RuntimeError(
+                node=node,
+                message='Invalid index expression: "%s"' % value,
+                index=index
+            )
+
+        if not 0 <= value < size:
+            raise RuntimeError(
+                node=node,
+                message='Index out of range',
+                index=index
+            )
+
+    return row * matrix.cols + col
+
+
 class BinaryOp(Expression):
     '''Operators representing an operation against two expressions `left` and `right`'''
     OPERATORS = []
@@ -511,6 +1295,10 @@ class ArithmeticOp(BinaryOp):
         l = self.left.evaluate(scope)
         r = self.right.evaluate(scope)
 
+        # Strings are only kept as ropes for concatenation
+        if self.op != '+':
+            r = flatten(r)
+
         # If the operation is not addition, then only allow integers and
         # floating point numbers. Else addition is ok for list and strings as
         # concatenation.
@@ -522,7 +1310,13 @@ class ArithmeticOp(BinaryOp):
 
         try:
             if self.op == '+':
-                return l + r
+                result = concat(l, r)
+                if (
+                    scope.context.memory is not None and
+                    isinstance(result, (list, str, Rope))
+                ):
+                    scope.context.memory.allocate(self, result, scope)
+                return result
             elif self.op == '-':
                 return l - r
             elif self.op == '*':
@@ -557,13 +1351,48 @@ class ArithmeticOp(BinaryOp):
             )
 
 
-class ComparisonOp(BinaryOp):
-    OPERATORS = ['==', '!=', '<', '>', '<=', '>=']
+class NumericArithmeticOp(ArithmeticOp):
+    '''Arithmetic on operands proven to be numbers by `analysis.TypeInference`
+
+    Skips the operand type checks of `ArithmeticOp`, division by zero still
+    has to be checked against the actual value.
+    '''
+    FUNCTIONS = {
+        '+': operator.add,
+        '-': operator.sub,
+        '*': operator.mul,
+        '/': operator.truediv,
+        '//': operator.floordiv,
+        '%': operator.mod,
+        '^': operator.pow,
+    }
 
     def evaluate(self, scope):
         l = self.left.evaluate(scope)
         r = self.right.evaluate(scope)
 
+        if r == 0 and self.op in ['/', '//', '%']:
+            raise RuntimeError(
+                node=self.left,
+                message='Division by zero'
+            )
+
+        try:
+            return self.FUNCTIONS[self.op](l, r)
+        except ArithmeticError:
+            raise RuntimeError(
+                node=self.left,
+                message='Unable to evaluate operation "%s"' % self.op
+            )
+
+
+class ComparisonOp(BinaryOp):
+    OPERATORS = ['==', '!=', '<', '>', '<=', '>=']
+
+    def evaluate(self, scope):
+        l = flatten(self.left.evaluate(scope))
+        r = flatten(self.right.evaluate(scope))
+
         if (
             not isinstance(l, type(r)) and
             (not isinstance(r, (int, float, long)) or not isinstance(l, (int, float, long)))
@@ -575,7 +1404,10 @@ class ComparisonOp(BinaryOp):
 
         # Only allow equality comparison for lists
         if self.op not in ['==', '!=']:
-            if isinstance(l, (list, str, bool)) or isinstance(r, (list, str, bool)):
+            if (
+                isinstance(l, (list, str, bool, dict, Matrix)) or
+                isinstance(r, (list, str, bool, dict, Matrix))
+            ):
                 raise RuntimeError(
                     node=self.left,
                     message='Unsupported operation "%s" for type' % self.op
@@ -595,6 +1427,23 @@ class ComparisonOp(BinaryOp):
             return l >= r
 
 
+class NumericComparisonOp(ComparisonOp):
+    '''Comparison of operands proven to be numbers by `analysis.TypeInference`'''
+    FUNCTIONS = {
+        '==': operator.eq,
+        '!=': operator.ne,
+        '<': operator.lt,
+        '>': operator.gt,
+        '<=': operator.le,
+        '>=': operator.ge,
+    }
+
+    def evaluate(self, scope):
+        return self.FUNCTIONS[self.op](
+            self.left.evaluate(scope), self.right.evaluate(scope)
+        )
+
+
 class LogicalOp(BinaryOp):
     OPERATORS = ['and', 'or']
 
@@ -655,8 +1504,14 @@ class UnaryOp(Expression):
             return -expr
 
 
+class NumericNegation(UnaryOp):
+    '''Negation of an operand proven to be a number by `analysis.TypeInference`'''
+    def evaluate(self, scope):
+        return -self.expr.evaluate(scope)
+
+
 class Length(Expression):
-    '''Get the length of list or string'''
+    '''Get the length of list, string or map, or the rows of a matrix'''
     def __init__(self, array, *args, **kwargs):
         super(Length, self).__init__(*args, **kwargs)
         if not isinstance(array, Expression):
@@ -669,6 +1524,6 @@ class Length(Expression):
 
     def evaluate(self, scope=root_scope):
         a = self.array.evaluate(scope)
-        if not isinstance(a, (list, str)):
+        if not isinstance(a, (list, str, LazySequence, dict, Matrix)):
             raise RuntimeError(node=self, index=2, message='Unable to calculate length of a non-list')
         return len(a)
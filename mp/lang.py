@@ -1,15 +1,28 @@
+import argparse
 from copy import copy
 import functools
+import os
+import socket
+from StringIO import StringIO
 import sys
 
 from ply import lex, yacc
 
 from ast import *
+from analysis import analyze
+import library
+from memory import MemoryTracker, parse_size
+import modules
+from scheduler import Scheduler
+from server import Server, failure
+import snapshot
 
 reserved = {
     'function': 'FUNCTION',
     'return': 'RETURN',
     'while': 'WHILE',
+    'for': 'FOR',
+    'in': 'IN',
     'print': 'PRINT',
     'if': 'IF',
     'else': 'ELSE',
@@ -17,6 +30,7 @@ reserved = {
     'or': 'OP_OR',
     'not': 'OP_NOT',
     'len': 'LEN',
+    'import': 'IMPORT',
 }
 
 tokens = [
@@ -24,10 +38,12 @@ tokens = [
     'FLOAT', 'INTEGER',
     'NAME', 'STRING',
     'OP_FLOOR_DIV', 'OP_EQ', 'OP_NEQ', 'OP_GTEQ', 'OP_LTEQ',
+    # Unparsed function body, only produced by `LazyLexer`
+    'BODY',
 ] + list(reserved.values())
 
 literals = [
-    '=', '[', ']', ',', ';', '(', ')', '{', '}',
+    '=', '[', ']', ',', ';', '(', ')', '{', '}', ':',
     '+', '-', '*', '/', '%', '^', '>', '<', '!', '"'
 ]
 
@@ -43,6 +59,14 @@ precedence = (
 )
 
 source = ''
+# File being parsed, if any
+source_name = None
+# Directory of the file being parsed, where its imports are looked up first
+directory = os.getcwd()
+# Whether function bodies are only parsed when first called (`--lazy`)
+lazy = False
+# Closing brace of the function body being parsed by `parse_body`
+closing = None
 
 def t_FLOAT(t):
     r'\d+\.\d+'
@@ -91,29 +115,102 @@ def t_NEWLINE(t):
 t_ignore = ' \t'
 
 def t_error(t):
-    print_error(
-        "Parse error",
-        "Unrecognized character: %s" % t.value[0],
-        t.lineno,
-        t.lexpos
-    )
-    t.lexer.skip(1)
+    raise ParseError(token=t)
 
 lexer = lex.lex()
 
+
+class LazyLexer(object):
+    '''Wrap `lexer` to skip the bodies of function definitions
+
+    The tokens of a function body, from the opening brace to the matching
+    closing brace, are replaced by a single BODY token whose value is the
+    `LazyBody` of the function. Only the code of the input from `start` up to
+    `end` (the whole input by default) starting at line `lineno` is read.
+    '''
+    def __init__(self, lexer, start=0, end=None, lineno=1):
+        self.lexer = lexer
+        self.start = start
+        self.end = end
+        self.first_line = lineno
+        # Whether the tokens are in the header of a function definition and
+        # whether the last one was the closing parenthesis of the header
+        self.header = False
+        self.opening = False
+
+    @property
+    def lineno(self):
+        return self.lexer.lineno
+
+    @property
+    def lexpos(self):
+        return self.lexer.lexpos
+
+    def input(self, data):
+        self.lexer.input(data)
+        self.lexer.lexpos = self.start
+        self.lexer.lineno = self.first_line
+
+    def next(self):
+        token = self.lexer.token()
+        if token is not None and self.end is not None and token.lexpos >= self.end:
+            return None
+        return token
+
+    def token(self):
+        token = self.next()
+        if token is None:
+            return None
+
+        opening, self.opening = self.opening, False
+        if token.type == 'FUNCTION':
+            self.header = True
+        elif self.header and token.type == ')':
+            self.header = False
+            self.opening = True
+        elif opening and token.type == '{':
+            return self.body(token)
+        return token
+
+    def body(self, opening):
+        depth = 1
+        while depth:
+            token = self.next()
+            if token is None:
+                # Unbalanced braces, let the parser report the opening one
+                return opening
+            if token.type == '{':
+                depth += 1
+            elif token.type == '}':
+                depth -= 1
+
+        body = lex.LexToken()
+        body.type = 'BODY'
+        body.value = LazyBody(
+            source, source_name, directory, opening.lexpos + 1, token.lexpos,
+            opening.lineno, (token.lineno, token.lexpos)
+        )
+        body.lineno = opening.lineno
+        body.lexpos = opening.lexpos
+        return body
+
 def inject_production(f):
     '''Wrapper to make sure to inject the YACC production into the AST Node
 
     A convenience wrapper that allows you to automatically inject the YACC
     production when the grammar rule returns an AST node. These YACC productions
     are useful when printing error messages since they contain the parsed
-    code.
+    code. The productions also keep the source they were parsed from (and the
+    name of its file), so errors in code that came from elsewhere (i.e.
+    snapshots) are reported correctly.
     '''
     @functools.wraps(f)
     def wrapper(p):
         f(p)
         if p[0] is not None and isinstance(p[0], Node):
             p[0].p = copy(p)
+            p[0].p.source = source
+            p[0].p.filename = source_name
 
     wrapper.co_firstlineno = f.__code__.co_firstlineno
     return wrapper
@@ -121,7 +218,7 @@ def inject_production(f):
 @inject_production
 def p_main(p):
     """main : statement_list"""
-    p[0] = p[1].execute()
+    p[0] = p[1]
 
 @inject_production
 def p_statement_list(p):
@@ -176,6 +273,11 @@ def p_statement_loop(p):
     '''statement : WHILE "(" expression ")" "{" statement_list "}"'''
     p[0] = Loop(expr=p[3], body=p[6], p=p)
 
+@inject_production
+def p_statement_for_each(p):
+    '''statement : FOR "(" NAME IN expression ")" "{" statement_list "}"'''
+    p[0] = ForEach(name=p[3], expr=p[5], body=p[8], p=p)
+
 @inject_production
 def p_function_definition(p):
     '''statement : FUNCTION NAME "(" ")" "{" statement_list "}"
@@ -186,6 +288,21 @@ def p_function_definition(p):
     else:
         p[0] = Function(name=p[2], arg_list=[], body=p[6])
 
+@inject_production
+def p_lazy_function_definition(p):
+    '''statement : FUNCTION NAME "(" ")" BODY
+                 | FUNCTION NAME "(" arg_list ")" BODY
+    '''
+    if len(p) > 6:
+        p[0] = Function(name=p[2], arg_list=p[4], body=p[6])
+    else:
+        p[0] = Function(name=p[2], arg_list=[], body=p[5])
+
+
+@inject_production
+def p_import(p):
+    '''statement : IMPORT STRING'''
+    p[0] = Import(path=p[2], directory=directory)
 
 @inject_production
 def p_return(p):
@@ -201,6 +318,11 @@ def p_arg_list(p):
     else:
         p[0] = [p[1]]
 
+@inject_production
+def p_assign_matrix_index(p):
+    '''statement : expression "[" expression "," expression "]" "=" expression'''
+    p[0] = MatrixAssign(ref=p[1], row=p[3], col=p[5], value=p[8])
+
 @inject_production
 def p_assign_index(p):
     '''statement : expression "[" expression "]" "=" expression'''
@@ -228,6 +350,22 @@ def p_expression_index(p):
     'expression : expression "[" expression "]"'
     p[0] = Index(target=p[1], index=p[3])
 
+@inject_production
+def p_expression_matrix_index(p):
+    'expression : expression "[" expression "," expression "]"'
+    p[0] = MatrixIndex(target=p[1], row=p[3], col=p[5])
+
+@inject_production
+def p_expression_slice(p):
+    '''expression : expression "[" expression ":" expression "]"
+                  | expression "[" expression ":" "]"
+                  | expression "[" ":" expression "]"
+                  | expression "[" ":" "]"'''
+    bounds = [p[i] for i in range(3, len(p) - 1)]
+    start = bounds[0] if isinstance(bounds[0], Expression) else None
+    stop = bounds[-1] if isinstance(bounds[-1], Expression) else None
+    p[0] = Slice(target=p[1], start=start, stop=stop)
+
 @inject_production
 def p_expression_atom(p):
     '''expression : atom
@@ -237,6 +375,24 @@ def p_expression_atom(p):
     else:
         p[0] = p[1]
 
+@inject_production
+def p_expression_map(p):
+    '''expression : "{" "}"
+                  | "{" map_items "}"'''
+    if len(p) > 3:
+        p[0] = Map(items=p[2])
+    else:
+        p[0] = Map(items=[])
+
+def p_map_items(p):
+    '''map_items : expression ":" expression
+                 | map_items "," expression ":" expression'''
+    if len(p) > 4:
+        p[1].append((p[3], p[5]))
+        p[0] = p[1]
+    else:
+        p[0] = [(p[1], p[3])]
+
 @inject_production
 def p_expression_arithmetic(p):
     '''expression : expression "+" expression
@@ -312,47 +468,227 @@ def p_atom_number(p):
 def p_error(p):
     if p:
         raise SyntaxError(token=p)
+    elif closing is not None:
+        # The function body ended in the middle of a statement
+        token = lex.LexToken()
+        token.type = '}'
+        (token.lineno, token.lexpos) = closing
+        raise SyntaxError(token=token)
     else:
-        print_error(
-            "Syntax error",
-            "Unexpected end of file",
-            source.count('\n'),
-            len(source) - 1
-        )
+        token = lex.LexToken()
+        token.type = 'end of file'
+        token.lexpos = len(source.rstrip())
+        token.lineno = source.count('\n', 0, token.lexpos) + 1
+        error = SyntaxError(token=token)
+        error.message = 'Unexpected end of file'
+        raise error
 
 def find_column(input, lexpos):
     line_start = input.rfind('\n', 0, lexpos) + 1
     return (lexpos - line_start) + 1
 
 
-def print_error(error, message, line_number, pos):
-    '''Print the error with a context on where it happened'''
+def format_error(error, message, line_number, pos, code=None):
+    '''Format the error with a context on where it happened in `code`'''
+    if code is None:
+        code = source
+
+    lines = code.split('\n')
+    return "%s at line %d: %s\n %s\n %s^" % (
+        error, line_number, message,
+        lines[line_number - 1],
+        " " * find_column(code, pos - 1)
+    )
 
-    lines = source.split('\n')
-    print "%s at line %d: %s" % (error, line_number, message)
-    print " %s" % lines[line_number - 1]
-    print " %s^" % (" " * find_column(source, pos - 1))
+
+def describe(error, code=None):
+    '''Format a jt error raised by parsing or running `code`'''
+    return format_error(
+        error_type(error), error.message, error.line_number, error.pos,
+        error.source or code
+    )
+
+
+ERRORS = (LexicalError, ParseError, RuntimeError)
+
+
+def error_type(error):
+    if isinstance(error, LexicalError):
+        return "Lexical error"
+    elif isinstance(error, SyntaxError):
+        return "Syntax error"
+    elif isinstance(error, ParseError):
+        return "Parse error"
+    return "Runtime error"
 
 
 parser = yacc.yacc()
 
-def parse(code):
+def compile_program(code, dump_types=False, filename=None):
+    '''Parse and analyze `code`, returning the program without running it
+
+    `filename` is the file the code was read from, if any.
+    '''
+    global source, source_name, directory
+    source = code
+    source_name = filename
+    directory = os.path.dirname(os.path.abspath(filename)) if filename else os.getcwd()
+    lexer.lineno = 1
     try:
-        return parser.parse(code, tracking=True)
-    except LexicalError as error:
-        print_error("Lexical error", error.message, error.line_number, error.pos)
-        return error
-    except SyntaxError as error:
-        print_error("Syntax error", error.message, error.line_number, error.pos)
-        return error
+        program = parser.parse(
+            code, lexer=LazyLexer(lexer) if lazy else lexer, tracking=True
+        )
     except ParseError as error:
-        print_error("Parse error", error.message, error.line_number, error.pos)
-        return error
-    except RuntimeError as error:
-        print_error("Runtime error", error.message, error.line_number, error.pos)
+        # Modules are compiled while running the importing program
+        error.source = error.source or code
+        raise
+    if program is not None:
+        analyze(program, dump=sys.stderr if dump_types else None)
+    return program
+
+
+def parse_body(body):
+    '''Parse and analyze the statements of a `LazyBody`'''
+    global source, source_name, directory, closing
+    state = (source, source_name, directory, closing)
+    (source, source_name, directory, closing) = (
+        body.source, body.filename, body.directory, body.closing
+    )
+    try:
+        statements = parser.parse(
+            body.source,
+            lexer=LazyLexer(lexer, body.start, body.end, body.lineno),
+            tracking=True
+        )
+        analyze(statements)
+        return statements
+    except ParseError as error:
+        error.source = body.source
+        raise
+    finally:
+        (source, source_name, directory, closing) = state
+
+
+modules.compiler = compile_program
+LazyBody.parser = staticmethod(parse_body)
+
+
+def parse(code, dump_types=False, filename=None):
+    try:
+        program = compile_program(code, dump_types=dump_types, filename=filename)
+        if program is None:
+            return None
+
+        return program.execute()
+    except ERRORS as error:
+        print describe(error)
         return error
 
 
+def run_concurrently(
+    filenames, time_slice, dump_types=False, prelude=None,
+    mem_report=False, mem_limit=None
+):
+    '''Run several programs at once, printing their output once all finish
+
+    Each program starts from the snapshot file `prelude` when given and has
+    its memory tracked separately.
+    '''
+    global source
+
+    scheduler = Scheduler(time_slice=time_slice)
+    tasks = []
+    for filename in filenames:
+        with open(filename) as source_file:
+            source = source_file.read()
+
+        try:
+            program = compile_program(source, dump_types=dump_types, filename=filename)
+        except ERRORS as error:
+            # Reported with the output of the programs that ran
+            tasks.append((source, filename, error))
+            continue
+
+        task = scheduler.spawn(program, name=filename)
+        if prelude is not None:
+            snapshot.load(task.scope, prelude)
+        if mem_report or mem_limit is not None:
+            task.memory = MemoryTracker(mem_limit)
+        tasks.append((source, filename, task))
+
+    scheduler.run()
+
+    for (code, filename, task) in tasks:
+        print "==> %s <==" % filename
+        if isinstance(task, ERRORS):
+            print describe(task, code)
+            continue
+
+        sys.stdout.write(task.output.getvalue())
+        if isinstance(task.error, ERRORS):
+            print describe(task.error, code)
+        elif task.error is not None:
+            print "Internal error: %r" % task.error
+
+        if mem_report:
+            task.memory.report(sys.stderr, task.scope)
+
+
+# Programs compiled by the server, by their source and file name
+compiled = {}
+COMPILED_LIMIT = 256
+
+
+def run_request(request, prelude=None, mem_limit=None):
+    '''Run the program of a `server` request in a scope of its own
+
+    The program starts from the snapshot file `prelude` when given. Programs
+    are only compiled the first time they are requested.
+    '''
+    filename = request.get('filename')
+    code = request.get('source')
+    try:
+        if request.get('path') is not None:
+            filename = request['path'].encode('utf-8')
+            with open(filename) as source_file:
+                code = source_file.read()
+        elif isinstance(code, basestring):
+            code = code.encode('utf-8')
+            filename = filename.encode('utf-8') if filename else None
+        else:
+            return failure('Request without a program')
+    except IOError as error:
+        return failure('Unable to read %s: %s' % (filename, error.strerror))
+
+    context = Context(
+        output=StringIO(),
+        input=StringIO(request.get('input', '').encode('utf-8')),
+        memory=MemoryTracker(mem_limit) if mem_limit is not None else None
+    )
+    scope = Scope(context=context)
+
+    error = None
+    try:
+        key = (code, filename)
+        if key not in compiled:
+            if len(compiled) >= COMPILED_LIMIT:
+                compiled.clear()
+            compiled[key] = compile_program(code, filename=filename)
+
+        if prelude is not None:
+            snapshot.load(scope, prelude)
+        if compiled[key] is not None:
+            compiled[key].execute(scope)
+    except ERRORS as e:
+        error = describe(e, code)
+
+    return {
+        'output': context.output.getvalue().decode('utf-8', 'replace'),
+        'error': error,
+        'status': 0 if error is None else 1,
+    }
+
+
 def get_line(prompt):
     line = raw_input(prompt)
     if not line.strip().endswith('{') and not line.strip().endswith(';'):
@@ -360,13 +696,99 @@ def get_line(prompt):
     return line
 
 
+arguments = argparse.ArgumentParser(description='Run a jt program or a REPL session')
+arguments.add_argument(
+    'files', nargs='*', metavar='file',
+    help='program to run instead of a REPL session, several programs are run concurrently'
+)
+arguments.add_argument(
+    '--time-slice', type=float, default=10,
+    help='milliseconds a concurrently run program may execute before yielding to the next one'
+)
+arguments.add_argument(
+    '-I', '--path', action='append', default=[], metavar='DIR',
+    help='directory to look up imported modules in, can be given several times'
+)
+arguments.add_argument(
+    '--snapshot', metavar='PATH',
+    help='start from the functions and values saved in a snapshot file'
+)
+arguments.add_argument(
+    '--save-snapshot', metavar='PATH',
+    help='save the functions and values defined by the program to a snapshot file'
+)
+arguments.add_argument(
+    '--mem-report', action='store_true',
+    help='print the memory used by the program and where it was allocated to stderr'
+)
+arguments.add_argument(
+    '--mem-limit', type=parse_size, metavar='SIZE',
+    help='stop the program when its values use more than SIZE (i.e. 512K, 100M, 2G)'
+)
+arguments.add_argument(
+    '--lazy', action='store_true',
+    help='only parse the body of a function when it is first called, reporting its syntax errors then'
+)
+arguments.add_argument(
+    '--serve', metavar='SOCKET',
+    help='run the programs sent by clients (see server.py) to a Unix socket until interrupted'
+)
+arguments.add_argument(
+    '--dump-types', action='store_true',
+    help='print the types inferred for names and operators to stderr'
+)
+
+
 def main():
-    global source
+    global source, lazy
+    options = arguments.parse_args()
+    modules.search_path[:0] = options.path
+    lazy = options.lazy
+
+    if len(options.files) > 1 and options.save_snapshot:
+        arguments.error('--save-snapshot requires a single program')
+
+    if options.mem_report or options.mem_limit is not None:
+        default_context.memory = MemoryTracker(options.mem_limit)
+
+    try:
+        if options.snapshot and len(options.files) <= 1:
+            snapshot.load(root_scope, options.snapshot)
+    except (snapshot.SnapshotError, IOError) as error:
+        print >> sys.stderr, "Unable to load snapshot: %s" % error
+        sys.exit(1)
+
+    if options.serve:
+        if options.files:
+            arguments.error('--serve runs the programs sent by clients, not files')
+        # Every request loads the snapshot again, so that it starts from the
+        # original values
+        handler = functools.partial(
+            run_request, prelude=options.snapshot, mem_limit=options.mem_limit
+        )
+        try:
+            server = Server(options.serve, handler)
+        except socket.error as error:
+            print >> sys.stderr, "Unable to serve: %s" % error
+            sys.exit(1)
+        server.serve()
+        return
+
+    if len(options.files) > 1:
+        try:
+            run_concurrently(
+                options.files, options.time_slice / 1000.0,
+                dump_types=options.dump_types, prelude=options.snapshot,
+                mem_report=options.mem_report, mem_limit=options.mem_limit
+            )
+        except (snapshot.SnapshotError, IOError) as error:
+            print >> sys.stderr, "Unable to load snapshot: %s" % error
+            sys.exit(1)
     # Try to open file as input when provided as command line argument
-    if len(sys.argv) >= 2:
-        with open(sys.argv[1]) as source_file:
+    elif options.files:
+        with open(options.files[0]) as source_file:
             source = source_file.read()
-            parse(source)
+            parse(source, dump_types=options.dump_types, filename=options.files[0])
     # Run a REPL session
     else:
         line = ''
@@ -382,12 +804,22 @@ def main():
                             break
 
                 source = line
-                r = parse(line)
+                r = parse(line, dump_types=options.dump_types)
                 if r is not None:
                     print r
         except (EOFError, KeyboardInterrupt):
             print "Exit"
 
+    if options.save_snapshot:
+        try:
+            snapshot.save(root_scope, options.save_snapshot)
+        except (snapshot.SnapshotError, IOError) as error:
+            print >> sys.stderr, "Unable to save snapshot: %s" % error
+            sys.exit(1)
+
+    if options.mem_report and len(options.files) <= 1:
+        default_context.memory.report(sys.stderr, root_scope)
+
 
 
 if __name__ == '__main__':
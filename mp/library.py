@@ -0,0 +1,315 @@
+'''Builtin functions available to every jt program
+
+Importing this module registers the functions below with `ast.builtin`. A
+function defined by the program with the same name takes precedence.
+'''
+import array
+import multiprocessing
+import sys
+
+from ast import *
+from streams import Stream, open_stream, input_stream
+
+
+# The function and scope of the running `pmap`, inherited by the forked
+# worker processes
+_pmap_call = None
+
+
+def _pmap_init():
+    # Programs run by a scheduler switch to the other programs at checkpoints
+    # (see `scheduler.Task`), which only run in the parent process, so
+    # switching would wait for them forever
+    context = _pmap_call[1].context
+    context.checkpoint = Context.checkpoint.__get__(context)
+
+
+def _pmap_worker(item):
+    function, scope = _pmap_call
+    try:
+        return (True, function.call([item], scope))
+    except (LexicalError, RuntimeError) as error:
+        return (False, '%s (line %d)' % (error.message, error.line_number))
+
+
+@builtin('pmap')
+def pmap(node, scope, function, items, workers=None):
+    '''Apply `function` to every item of `items` on a pool of worker processes
+
+    `function` is either a function or the name of one and must take exactly
+    one argument. Results are returned as a list in the order of `items`.
+    Workers are forked with a copy of the interpreter, so every function and
+    value defined at the time of the call is available to them, but changes
+    they make (and output they print) are not coordinated with each other.
+    '''
+    global _pmap_call
+
+    if isinstance(function, str):
+        name = function
+        try:
+            function = scope[name]
+        except LookupError:
+            raise RuntimeError(node=node, message='Undefined name: %s' % name)
+        if not isinstance(function, Function):
+            raise RuntimeError(node=node, message='Not a function: %s' % name)
+    if not isinstance(function, Function):
+        raise RuntimeError(node=node, message='pmap expects a function')
+    if len(function.arg_list) != 1:
+        raise RuntimeError(
+            node=node,
+            message='pmap expects a function of 1 argument, %s takes %d' % (
+                function.name, len(function.arg_list)
+            )
+        )
+
+    items = flatten(items)
+    if not isinstance(items, list):
+        raise RuntimeError(node=node, message='pmap expects a list')
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if not isinstance(workers, int) or workers < 1:
+        raise RuntimeError(
+            node=node, message='Invalid worker count: "%s"' % workers
+        )
+
+    # Not worth starting processes for
+    if workers == 1 or len(items) <= 1:
+        return [function.call([item], scope) for item in items]
+
+    # Output buffered before forking would be written again by every worker
+    sys.stdout.flush()
+
+    _pmap_call = (function, scope)
+    pool = multiprocessing.Pool(min(workers, len(items)), _pmap_init)
+    try:
+        results = pool.map(
+            _pmap_worker, items, max(1, len(items) // (workers * 4))
+        )
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        _pmap_call = None
+
+    values = []
+    for result in results:
+        if not result[0]:
+            raise RuntimeError(node=node, message='pmap failed: %s' % result[1])
+        values.append(result[1])
+    return values
+
+
+@builtin('keys')
+def keys(node, scope, items):
+    '''Return the keys of a map as a sorted list'''
+    if not isinstance(items, dict):
+        raise RuntimeError(node=node, message='keys expects a map')
+    return sorted(items)
+
+
+@builtin('has')
+def has(node, scope, items, key):
+    '''Return whether a map has the key `key`'''
+    if not isinstance(items, dict):
+        raise RuntimeError(node=node, message='has expects a map')
+    return map_key(node, key) in items
+
+
+@builtin('readline')
+def readline(node, scope, stream=None):
+    '''Read the next line of `stream`, or of the standard input
+
+    The line keeps its newline, so only the end of the input returns an empty
+    string.
+    '''
+    if stream is None:
+        line = (scope.context.input or sys.stdin).readline()
+    elif isinstance(stream, Stream):
+        line = stream.readline()
+    else:
+        raise RuntimeError(node=node, message='readline expects a stream')
+
+    if scope.context.memory is not None:
+        scope.context.memory.allocate(node, line, scope)
+    return line
+
+
+@builtin('lines')
+def lines(node, scope, path=None):
+    '''Return a stream of the lines of the file `path`, or of the standard
+    input, to be read with `readline`'''
+    if path is None:
+        return input_stream(scope.context)
+
+    path = flatten(path)
+    if not isinstance(path, str):
+        raise RuntimeError(node=node, message='lines expects a file name')
+    try:
+        return open_stream(path)
+    except IOError as e:
+        raise RuntimeError(
+            node=node, message='Unable to open "%s": %s' % (path, e.strerror)
+        )
+
+
+@builtin('split')
+def split(node, scope, text, separator=None):
+    '''Split a string at every `separator`, or at runs of whitespace'''
+    text = flatten(text)
+    separator = flatten(separator)
+    if not isinstance(text, str):
+        raise RuntimeError(node=node, message='split expects a string')
+    if separator is not None and (not isinstance(separator, str) or not separator):
+        raise RuntimeError(node=node, message='Invalid separator: "%s"' % separator)
+
+    items = text.split(separator)
+    if scope.context.memory is not None:
+        scope.context.memory.allocate(node, items, scope)
+    return items
+
+
+@builtin('int')
+def to_int(node, scope, value):
+    '''Convert a number or a string like "42" to an integer'''
+    value = flatten(value)
+    if isinstance(value, (int, long, float, str)) and not isinstance(value, bool):
+        try:
+            return int(value)
+        except (ValueError, OverflowError):
+            pass
+    raise RuntimeError(node=node, message='Invalid integer: "%s"' % value)
+
+
+@builtin('float')
+def to_float(node, scope, value):
+    '''Convert a number or a string like "4.2" to a floating point number'''
+    value = flatten(value)
+    if isinstance(value, (int, long, float, str)) and not isinstance(value, bool):
+        try:
+            return float(value)
+        except (ValueError, OverflowError):
+            pass
+    raise RuntimeError(node=node, message='Invalid number: "%s"' % value)
+
+
+@builtin('range')
+def range_(node, scope, start, stop=None, step=1):
+    '''Return the integers from `start` up to `stop`, or from 0 up to `start`
+
+    The integers are not stored, so ranges can be arbitrarily long.
+    '''
+    if stop is None:
+        (start, stop) = (0, start)
+
+    for value in [start, stop, step]:
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise RuntimeError(
+                node=node, message='Invalid range bound: "%s"' % value
+            )
+    if step == 0:
+        raise RuntimeError(node=node, message='Range step must not be 0')
+
+    return Range(start, stop, step)
+
+
+@builtin('matrix')
+def matrix(node, scope, rows, cols, fill=0):
+    '''Return a matrix of `rows` by `cols` numbers, all set to `fill`'''
+    for size in [rows, cols]:
+        if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+            raise RuntimeError(node=node, message='Invalid matrix size: "%s"' % size)
+    if not is_number(fill):
+        raise RuntimeError(node=node, message='Invalid matrix item: "%s"' % fill)
+
+    try:
+        result = Matrix(rows, cols, fill)
+    except OverflowError:
+        raise RuntimeError(node=node, message='Number too large for a matrix: %d' % fill)
+
+    if scope.context.memory is not None:
+        scope.context.memory.allocate(node, result, scope)
+    return result
+
+
+def check_matrix(node, m):
+    if not isinstance(m, Matrix):
+        raise RuntimeError(node=node, message='Expected a matrix, got "%s"' % m)
+
+
+def check_index(node, index, size):
+    if not isinstance(index, int) or isinstance(index, bool) or not 0 <= index < size:
+        raise RuntimeError(node=node, message='Index out of range: %s' % index)
+
+
+def numbers(node, items, count):
+    '''Validate a list of `count` numbers to store in a matrix'''
+    items = flatten(items)
+    if not isinstance(items, list) or len(items) != count:
+        raise RuntimeError(node=node, message='Expected a list of %d numbers' % count)
+    for item in items:
+        if not is_number(item):
+            raise RuntimeError(node=node, message='Invalid matrix item: "%s"' % item)
+    return items
+
+
+@builtin('rows')
+def rows(node, scope, m):
+    '''Return the number of rows of a matrix'''
+    check_matrix(node, m)
+    return m.rows
+
+
+@builtin('cols')
+def cols(node, scope, m):
+    '''Return the number of columns of a matrix'''
+    check_matrix(node, m)
+    return m.cols
+
+
+@builtin('row')
+def row(node, scope, m, i):
+    '''Return the row `i` of a matrix as a list'''
+    check_matrix(node, m)
+    check_index(node, i, m.rows)
+    return m.row(i).tolist()
+
+
+@builtin('col')
+def col(node, scope, m, j):
+    '''Return the column `j` of a matrix as a list'''
+    check_matrix(node, m)
+    check_index(node, j, m.cols)
+    return m.col(j).tolist()
+
+
+@builtin('set_row')
+def set_row(node, scope, m, i, items):
+    '''Set the row `i` of a matrix to the numbers of a list'''
+    check_matrix(node, m)
+    check_index(node, i, m.rows)
+    items = numbers(node, items, m.cols)
+
+    if any(isinstance(item, float) for item in items):
+        m.promote()
+    try:
+        m.items[i * m.cols:(i + 1) * m.cols] = array.array(m.items.typecode, items)
+    except OverflowError:
+        raise RuntimeError(node=node, message='Number too large for a matrix')
+
+
+@builtin('set_col')
+def set_col(node, scope, m, j, items):
+    '''Set the column `j` of a matrix to the numbers of a list'''
+    check_matrix(node, m)
+    check_index(node, j, m.cols)
+    items = numbers(node, items, m.rows)
+
+    if any(isinstance(item, float) for item in items):
+        m.promote()
+    try:
+        m.items[j::m.cols] = array.array(m.items.typecode, items)
+    except OverflowError:
+        raise RuntimeError(node=node, message='Number too large for a matrix')
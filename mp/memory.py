@@ -0,0 +1,169 @@
+'''Accounting of the memory used by the values of a running program
+
+When a `MemoryTracker` is set as the `memory` of a context, the nodes that
+create lists, strings and call frames report every allocation to it. The
+tracker totals the allocations by source line and every so often measures
+everything reachable from the running scope, which (as scopes are chained to
+the scope of their caller) covers every variable of every active call.
+The peak is the largest of these measurements, so it is sampled rather than
+exact. When a limit is set, exceeding it stops the program with a
+`RuntimeError`.
+'''
+import sys
+
+from ast import *
+
+
+# Measure the live values at least after this many bytes were allocated
+MIN_INTERVAL = 256 * 1024
+
+UNITS = [('G', 1024 ** 3), ('M', 1024 ** 2), ('K', 1024)]
+
+
+def parse_size(text):
+    '''Parse a size like `512K`, `100M` or `2G` to a number of bytes'''
+    text = text.strip().upper()
+    for (unit, factor) in UNITS:
+        if text.endswith(unit):
+            return int(float(text[:-1]) * factor)
+    return int(text)
+
+
+def format_size(size):
+    for (unit, factor) in UNITS:
+        if size >= factor:
+            return '%.1f %sB' % (size / float(factor), unit)
+    return '%d B' % size
+
+
+def size_of(value):
+    '''Size of a value, not counting the values it contains
+
+    A new rope shares its list of pieces with the rope it was built from, so
+    it only adds itself and a slot in that list.
+    '''
+    if isinstance(value, Rope):
+        return sys.getsizeof(value) + 8
+    elif isinstance(value, Matrix):
+        return sys.getsizeof(value) + sys.getsizeof(value.items)
+    return sys.getsizeof(value)
+
+
+def kind_of(value):
+    if isinstance(value, Rope):
+        return 'str'
+    elif isinstance(value, View):
+        return 'view'
+    elif isinstance(value, Matrix):
+        return 'matrix'
+    return type(value).__name__
+
+
+def measure(scope):
+    '''Total size by type of the values reachable from `scope` and its parents'''
+    totals = {}
+    seen = set()
+
+    pending = []
+    while scope is not None:
+        totals['frame'] = totals.get('frame', 0) + sys.getsizeof(scope.names)
+        pending.extend(scope.names.itervalues())
+        scope = scope.parent
+
+    while pending:
+        value = pending.pop()
+        if id(value) in seen or isinstance(value, Function):
+            continue
+        seen.add(id(value))
+
+        kind = kind_of(value)
+        totals[kind] = totals.get(kind, 0) + size_of(value)
+
+        if isinstance(value, list):
+            pending.extend(value)
+        elif isinstance(value, dict):
+            pending.extend(value.iterkeys())
+            pending.extend(value.itervalues())
+        elif isinstance(value, View):
+            pending.append(value.base)
+        elif isinstance(value, Rope) and id(value.parts) not in seen:
+            seen.add(id(value.parts))
+            totals['str'] += sys.getsizeof(value.parts)
+            pending.extend(value.parts)
+
+    return totals
+
+
+class MemoryTracker(object):
+    '''Collect the allocations of a program, stopping it above `limit` bytes'''
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.peak = 0
+        self.live = 0
+        self.sites = {}
+        self.pending = 0
+        self.interval = MIN_INTERVAL
+        if limit is not None:
+            self.interval = min(self.interval, self.closest(0))
+
+    def allocate(self, node, value, scope, kind=None, size=None):
+        '''Record that `node` created `value` while running in `scope`
+
+        `size` is the number of bytes allocated when `value` grew in place
+        instead of being created.
+        '''
+        if size is None:
+            size = size_of(value)
+        line = node.p.lineno(1) if node.p else 0
+        # Imported modules and lazily parsed bodies come from other files
+        filename = getattr(node.p, 'filename', None)
+        site = (filename, line, kind or kind_of(value))
+        (count, total) = self.sites.get(site, (0, 0))
+        self.sites[site] = (count + 1, total + size)
+
+        self.pending += size
+        if self.pending >= self.interval:
+            self.sample(node, scope, size)
+
+    def sample(self, node, scope, size):
+        # The new value may not be bound to a name yet
+        self.live = sum(measure(scope).itervalues()) + size
+        self.peak = max(self.peak, self.live)
+        self.pending = 0
+
+        self.interval = max(MIN_INTERVAL, self.live // 4)
+        if self.limit is not None:
+            if self.live > self.limit:
+                raise RuntimeError(
+                    node=node,
+                    message='Memory limit exceeded: %s in use, limit is %s' % (
+                        format_size(self.live), format_size(self.limit)
+                    )
+                )
+            self.interval = min(self.interval, self.closest(self.live))
+
+    def closest(self, live):
+        # Measure again before the limit could be exceeded by much
+        return max((self.limit - live) // 2, self.limit // 64, 1)
+
+    def report(self, out, scope, top=10):
+        '''Write the peak, the largest allocation sites and the values still
+        reachable from `scope` to `out`'''
+        totals = measure(scope)
+        self.peak = max(self.peak, sum(totals.itervalues()))
+
+        print >> out, 'Memory report'
+        print >> out, '  peak (sampled): %s' % format_size(self.peak)
+        print >> out, '  live at exit: %s' % format_size(sum(totals.itervalues()))
+        for (kind, total) in sorted(totals.items(), key=lambda item: -item[1]):
+            print >> out, '    %-8s %s' % (kind, format_size(total))
+
+        print >> out, '  largest allocation sites:'
+        sites = sorted(self.sites.items(), key=lambda item: -item[1][1])
+        for ((filename, line, kind), (count, total)) in sites[:top]:
+            where = 'line %d' % line
+            if filename is not None:
+                where = '%s, %s' % (filename, where)
+            print >> out, '    %s: %s in %d allocation(s) of %s' % (
+                where, format_size(total), count, kind
+            )
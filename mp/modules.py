@@ -0,0 +1,90 @@
+'''Module loading for `import "path";` statements
+
+A module is a jt file whose top-level names (usually function definitions)
+are copied into the scope of every program that imports it. Each module is
+parsed once per process (and again when the file changes) and executed once
+per program, in a scope of its own, and the result is reused by every later
+import of the same file in that program. Programs run together (see
+`scheduler`) or by the server each get their own module values and output.
+
+Relative paths are looked up in the directory of the importing file first,
+then in the directories of `search_path`, which starts with the directories
+listed in the `JTPATH` environment variable.
+'''
+import os
+
+from ast import *
+
+
+search_path = [
+    path for path in os.environ.get('JTPATH', '').split(os.pathsep) if path
+]
+
+# Function parsing and analyzing the code of a module, set by `lang`
+compiler = None
+
+# Modification times and parsed programs of the modules by their absolute path
+programs = {}
+
+
+def find(node):
+    '''Return the absolute path of the module imported by `node`'''
+    if os.path.isabs(node.path):
+        candidates = [node.path]
+    else:
+        candidates = [
+            os.path.join(directory, node.path)
+            for directory in [node.directory] + search_path
+        ]
+
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return os.path.abspath(candidate)
+
+    raise RuntimeError(
+        node=node,
+        index=2,
+        message='Module not found: "%s"' % node.path
+    )
+
+
+def compile_module(path):
+    '''Return the parsed program of the module `path`'''
+    modified = os.path.getmtime(path)
+    if programs.get(path, (None, None))[0] != modified:
+        with open(path) as module_file:
+            programs[path] = (modified, compiler(module_file.read(), filename=path))
+
+    return programs[path][1]
+
+
+def load(node, scope):
+    '''Execute the import statement `node` in `scope`'''
+    path = find(node)
+    context = scope.context
+    loaded = context.modules
+
+    if path not in loaded:
+        chain = context.importing
+        if path in chain:
+            raise RuntimeError(
+                node=node,
+                index=2,
+                message='Circular import: %s' % ' -> '.join(chain + [path])
+            )
+
+        chain.append(path)
+        try:
+            program = compile_module(path)
+            module_scope = Scope(context=context)
+            if program is not None:
+                program.execute(module_scope)
+            module_scope.names.pop('return', None)
+            loaded[path] = module_scope
+        finally:
+            chain.pop()
+
+    scope.names.update(loaded[path].names)
+
+
+Import.loader = staticmethod(load)
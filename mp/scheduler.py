@@ -0,0 +1,113 @@
+'''Run many jt programs concurrently in one process
+
+Each program runs as a `Task` with its own root scope and output. Tasks are
+cooperative: only one of them executes at a time, and the running task hands
+control to the next one at a loop iteration or function call once it has used
+up its time slice. Every task runs on its own thread so its (recursive) call
+stack is kept while it waits for its turn, but the scheduler makes sure that
+only one thread executes jt code at any moment.
+
+    scheduler = Scheduler(time_slice=0.005)
+    tasks = [scheduler.spawn(program, name) for (name, program) in programs]
+    scheduler.run()
+    for task in tasks:
+        print task.name, task.output.getvalue(), task.error
+'''
+from collections import deque
+from StringIO import StringIO
+import threading
+import time
+
+from ast import *
+
+
+class Task(Context):
+    '''A program run by a `Scheduler`
+
+    Once the scheduler is done, `output` contains everything the program
+    printed, `result` the value it returned and `error` the exception that
+    stopped it, if any.
+    '''
+    def __init__(self, scheduler, program, name=None):
+        super(Task, self).__init__(output=StringIO())
+        self.scheduler = scheduler
+        self.program = program
+        self.name = name
+        self.scope = Scope(context=self)
+
+        self.result = None
+        self.error = None
+        self.done = False
+        self.started = None
+
+    def checkpoint(self):
+        if time.time() - self.started >= self.scheduler.time_slice:
+            self.scheduler.switch(self)
+
+    def run(self):
+        self.scheduler.wait(self)
+        try:
+            self.result = self.program.execute(self.scope)
+        except Exception as error:
+            self.error = error
+        finally:
+            self.scheduler.finish(self)
+
+
+class Scheduler(object):
+    '''Interleave the execution of tasks, `time_slice` seconds at a time'''
+    def __init__(self, time_slice=0.01):
+        self.time_slice = time_slice
+        self.condition = threading.Condition()
+        self.ready = deque()
+        self.current = None
+        self.pending = []
+
+    def spawn(self, program, name=None):
+        '''Schedule a parsed program to run in a new scope and return its task'''
+        task = Task(self, program, name)
+        self.pending.append(task)
+        return task
+
+    def run(self):
+        '''Run every spawned task until they all finish'''
+        tasks, self.pending = self.pending, []
+        threads = []
+        with self.condition:
+            for task in tasks:
+                self.ready.append(task)
+                thread = threading.Thread(target=task.run, name=task.name)
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+            self.advance()
+
+        for thread in threads:
+            thread.join()
+
+    def advance(self):
+        # Must be called while holding `condition`
+        self.current = self.ready.popleft() if self.ready else None
+        self.condition.notify_all()
+
+    def wait(self, task):
+        '''Block the calling task until it is its turn to run'''
+        with self.condition:
+            while self.current is not task:
+                self.condition.wait()
+        task.started = time.time()
+
+    def switch(self, task):
+        '''Move the running task to the back of the queue and run the next one'''
+        with self.condition:
+            if not self.ready:
+                task.started = time.time()
+                return
+            self.ready.append(task)
+            self.advance()
+        self.wait(task)
+
+    def finish(self, task):
+        with self.condition:
+            task.done = True
+            self.advance()
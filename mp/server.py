@@ -0,0 +1,137 @@
+'''Serve jt programs from a long-running interpreter over a Unix socket
+
+Starting the interpreter (Python itself, `ply` and the parser tables) takes
+longer than running most short programs. A server started with
+
+    python lang.py --serve /tmp/jt.sock
+
+pays for it once and then runs the programs sent by clients, each in a scope
+of its own:
+
+    python server.py /tmp/jt.sock script.jt < input.txt
+
+The client only needs the standard library, so it starts quickly. Requests
+and responses are single lines of JSON. A request has either the `path` of
+the program or its `source` (and optionally the `filename` it was read from)
+and optionally the `input` the program reads. The response has the `output`
+of the program, the `error` that stopped it (or `null`) and an exit `status`:
+0 on success, 1 for errors of the program and 2 for invalid requests.
+
+Requests are answered one at a time, in the order they are received.
+'''
+import errno
+import json
+import os
+import signal
+import socket
+import SocketServer
+import stat
+import sys
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        # Connections closed without a request (i.e. by `remove_stale`)
+        if not line:
+            return
+
+        try:
+            request = json.loads(line)
+        except ValueError:
+            request = None
+
+        if not isinstance(request, dict):
+            response = failure('Invalid request')
+        else:
+            try:
+                response = self.server.handler(request)
+            except Exception as error:
+                # Keep serving the other clients
+                response = failure('Internal error: %r' % error)
+
+        self.wfile.write(json.dumps(response) + '\n')
+
+
+class Server(SocketServer.UnixStreamServer):
+    '''Answer the requests sent to the Unix socket `path` with `handler`
+
+    `handler` takes the decoded request and returns the response.
+    '''
+    def __init__(self, path, handler):
+        self.path = path
+        self.handler = handler
+        remove_stale(path)
+        SocketServer.UnixStreamServer.__init__(self, path, RequestHandler)
+
+    def serve(self):
+        '''Answer requests until interrupted or terminated'''
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server_close()
+            os.unlink(self.path)
+
+
+def remove_stale(path):
+    '''Remove the socket file `path` left behind by a server that is gone'''
+    if not os.path.exists(path):
+        return
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except socket.error as error:
+        if error.errno != errno.ECONNREFUSED:
+            raise
+        os.unlink(path)
+    else:
+        raise socket.error(errno.EADDRINUSE, 'A server is already listening on %s' % path)
+    finally:
+        probe.close()
+
+
+def failure(message):
+    return {'output': '', 'error': message, 'status': 2}
+
+
+def submit(path, request):
+    '''Send `request` to the server listening on `path` and return its response'''
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+        connection.sendall(json.dumps(request) + '\n')
+        return json.loads(connection.makefile('rb').readline())
+    finally:
+        connection.close()
+
+
+def main():
+    if len(sys.argv) != 3:
+        print >> sys.stderr, 'Usage: python server.py SOCKET FILE'
+        sys.exit(2)
+
+    request = {'path': os.path.abspath(sys.argv[2])}
+    # Forward piped or redirected input, terminals and sockets (i.e. when run
+    # by another program without input) might never reach the end
+    mode = os.fstat(sys.stdin.fileno()).st_mode
+    if stat.S_ISFIFO(mode) or stat.S_ISREG(mode):
+        request['input'] = sys.stdin.read().decode('utf-8', 'replace')
+
+    try:
+        response = submit(sys.argv[1], request)
+    except (socket.error, ValueError) as error:
+        print >> sys.stderr, 'Unable to reach the server: %s' % error
+        sys.exit(2)
+
+    sys.stdout.write(response['output'].encode('utf-8'))
+    if response['error'] is not None:
+        print response['error'].encode('utf-8')
+    sys.exit(response['status'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+'''Save the root scope of an interpreter and restore it in a later run
+
+Programs that start by defining the same functions and constant tables can
+run those definitions once, save the resulting scope to a snapshot and have
+every later run start from it instead:
+
+    python lang.py --save-snapshot prelude.snap prelude.jt
+    python lang.py --snapshot prelude.snap script.jt
+
+A snapshot is a small header followed by the pickled, compressed bindings
+of the scope (functions are saved with their parsed bodies). Snapshots are
+only loaded by the interpreter version that saved them.
+'''
+import cPickle as pickle
+from cStringIO import StringIO
+import sys
+import zlib
+
+from ast import *
+from streams import Stream
+
+
+MAGIC = 'jt-snapshot'
+
+# Bump whenever the AST nodes or value types change in a way that makes
+# previously pickled objects unusable
+SNAPSHOT_VERSION = 2
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def version():
+    return (SNAPSHOT_VERSION, tuple(sys.version_info[:2]))
+
+
+def save(scope, path):
+    '''Save the names bound in `scope` to the file `path`'''
+    names = dict(scope.names)
+    names.pop('return', None)
+
+    data = StringIO()
+    pickler = pickle.Pickler(data, pickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = restorable
+    try:
+        pickler.dump(names)
+    except (pickle.PicklingError, TypeError) as error:
+        raise SnapshotError('%s can\'t be saved: %s' % (path, error))
+
+    with open(path, 'wb') as snapshot:
+        pickle.dump((MAGIC, version()), snapshot, pickle.HIGHEST_PROTOCOL)
+        snapshot.write(zlib.compress(data.getvalue()))
+
+
+def restorable(value):
+    '''Reject the values that pickle but can't be restored'''
+    # Open files and memory maps pickle without their contents
+    if isinstance(value, Stream):
+        raise SnapshotError(
+            '%r can\'t be restored from a snapshot, open it after loading '
+            'the snapshot instead' % value
+        )
+    return None
+
+
+def load(scope, path):
+    '''Bind the names saved in the snapshot file `path` into `scope`'''
+    with open(path, 'rb') as snapshot:
+        try:
+            header = pickle.load(snapshot)
+        except Exception:
+            header = None
+
+        if not isinstance(header, tuple) or len(header) != 2 or header[0] != MAGIC:
+            raise SnapshotError('%s is not a snapshot' % path)
+
+        if header[1] != version():
+            raise SnapshotError(
+                '%s was saved by an incompatible interpreter (version %s, this is %s)' % (
+                    path, header[1], version()
+                )
+            )
+
+        try:
+            names = pickle.loads(zlib.decompress(snapshot.read()))
+        except Exception as error:
+            # Truncated or corrupted files fail in zlib or in any constructor
+            raise SnapshotError('%s is damaged: %s' % (path, error))
+
+    scope.names.update(names)
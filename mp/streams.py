@@ -0,0 +1,56 @@
+'''Lines of input read lazily from files and standard input
+
+A `Stream` returns one line at a time, so a program can process inputs much
+larger than the memory it uses. Files are memory mapped when possible: the
+operating system pages them in as they are read (and out again once read),
+instead of the interpreter copying them into buffers of its own.
+'''
+import mmap
+import sys
+
+from ast import ForEach
+
+
+class Stream(object):
+    '''Lines of a file-like `source` with a `readline` method
+
+    `readline` returns the next line including its newline, or an empty
+    string once there are no more lines.
+    '''
+    def __init__(self, source, name):
+        self.source = source
+        self.name = name
+
+    def readline(self):
+        return self.source.readline()
+
+    def close(self):
+        self.source.close()
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def __repr__(self):
+        return '<stream %s>' % self.name
+
+
+# Streams are iterated by line
+ForEach.iterables += (Stream,)
+
+
+def open_stream(path):
+    '''Return a stream of the lines of the file `path`'''
+    source = open(path, 'rb')
+    try:
+        mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    except (mmap.error, ValueError):
+        # Empty files, pipes and devices can't be mapped, read them instead
+        return Stream(source, path)
+
+    source.close()
+    return Stream(mapped, path)
+
+
+def input_stream(context):
+    '''Return a stream of the lines of the input of `context`'''
+    return Stream(context.input or sys.stdin, '<stdin>')